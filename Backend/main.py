@@ -1,23 +1,36 @@
+import asyncio
+import math
 import os
-from datetime import date, datetime
+import sys
+import time
+import warnings
+from datetime import date
 
 import joblib
 import numpy as np
 import pandas as pd
 import shap
 import uvicorn
+import xgboost as xgb
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from numba import njit
 from pydantic import BaseModel
+from sklearn import config_context
 
 
 # Load environment variables from .env (if present)
 load_dotenv()
 
+# Requests are fed to the scaler/model as plain arrays in training column order,
+# so the "fitted with feature names" warning carries no information here.
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
 
-# FastAPI app
-app = FastAPI(title="Loan Risk API")
+
+# FastAPI app (orjson serializes responses much faster than the stdlib json encoder)
+app = FastAPI(title="Loan Risk API", default_response_class=ORJSONResponse)
 
 
 # CORS (defaults to '*' if not provided)
@@ -35,16 +48,32 @@ custom_threshold = 0.5  # Default fallback
 risk_explainer = None
 model_features = None  # Used to enforce the training-time column order
 risk_scaler = None  # Optional: scaler for models that require normalized inputs
+FEATURE_INDEX = None  # Feature name -> position in model_features
+NUMERIC_IDX = None  # Model column of each NUMERIC_FEATURES entry (int64 array)
+PURPOSE_IDX = None  # One-hot lookups: raw category value -> model column
+APP_TYPE_IDX = None
+HOME_IDX = None
+VERIF_IDX = None
+REASON_TEXT = None  # Explanation sentence per model column (object array, indexable by position)
+_proba_fn = None  # Callable: feature matrix -> probability of class 1 (Rejected)
+_native_proba = False  # True when _proba_fn calls an XGBoost/LightGBM booster directly (not sklearn)
+_shap_fn = None  # Callable: feature matrix -> per-feature SHAP contributions
+LINEAR_COEF = None  # Linear models only: flattened coef_
+LINEAR_MEAN = None  # Linear models only: background mean per feature
 
 @app.on_event("startup")
 def load_artifacts():
     # Load the model bundle and initialize SHAP explainer.
-    global risk_model, custom_threshold, risk_explainer, model_features, risk_scaler
+    global risk_model, custom_threshold, risk_explainer, model_features, risk_scaler, FEATURE_INDEX, _proba_fn, _shap_fn
+    global _native_proba
+    global NUMERIC_IDX, PURPOSE_IDX, APP_TYPE_IDX, HOME_IDX, VERIF_IDX, REASON_TEXT, LINEAR_COEF, LINEAR_MEAN
     try:
         model_path = os.getenv("MODEL_PATH")
         print(f"Loading artifact bundle from: {model_path}")
         
-        bundle = joblib.load(model_path)
+        # Memory-map numpy arrays inside the bundle so worker processes share the same pages.
+        # This needs the bundle saved uncompressed (joblib.dump(..., compress=0)).
+        bundle = joblib.load(model_path, mmap_mode="r")
         
         risk_model = bundle.get("model")
         custom_threshold = bundle.get("threshold", 0.5)
@@ -56,6 +85,31 @@ def load_artifacts():
         if risk_model is None:
             raise ValueError("Model object is missing from the bundle!")
 
+        FEATURE_INDEX = {name: i for i, name in enumerate(model_features)}
+        NUMERIC_IDX = np.array([FEATURE_INDEX[name] for name in NUMERIC_FEATURES], dtype=np.int64)
+        REASON_TEXT = np.array(
+            [f"{FRIENDLY_NAMES.get(feat, feat)} influenced this decision" for feat in model_features], dtype=object
+        )
+        PURPOSE_IDX = one_hot_index("purpose_")
+        APP_TYPE_IDX = one_hot_index("application_type_")
+        VERIF_IDX = one_hot_index("verification_status_")
+        HOME_IDX = one_hot_index("home_ownership_new_")
+        # 'ANY' and 'NONE' were folded into 'OTHER' during training
+        for folded in ("ANY", "NONE"):
+            HOME_IDX.pop(folded, None)
+            if "OTHER" in HOME_IDX:
+                HOME_IDX[folded] = HOME_IDX["OTHER"]
+
+        # Categories without a column (e.g. drop_first reference levels) are encoded as all zeros
+        one_hot_maps = {
+            "purpose": PURPOSE_IDX, "application_type": APP_TYPE_IDX,
+            "verification_status": VERIF_IDX, "home_ownership": HOME_IDX,
+        }
+        for field, known in KNOWN_CATEGORIES.items():
+            reference = [value for value in known if value not in one_hot_maps[field]]
+            if reference:
+                print(f"One-hot: no model column for {field} {reference}; encoded as all zeros.")
+
         if risk_scaler:
             print("Scaler loaded successfully. Data will be normalized before prediction.")
         else:
@@ -63,27 +117,89 @@ def load_artifacts():
 
         print(f"Model loaded: {model_type} | Custom Threshold: {custom_threshold}")
 
+        # Typed all-zero background row, shared by the SHAP fallbacks below
+        zero_background = pd.DataFrame(np.zeros((1, len(model_features)), dtype=np.float32), columns=model_features)
+
         try:
             if "logistic" in model_type or "linear" in model_type:
                 # Linear models work best with an explicit background dataset.
                 if background_data is None:
                     print("WARNING: No background data found for Linear Model. SHAP may fail.")
-                    background_data = pd.DataFrame(0, index=np.arange(1), columns=model_features)
+                    background_data = zero_background
                 
                 risk_explainer = shap.LinearExplainer(risk_model, background_data)
                 print("SHAP: LinearExplainer initialized.")
                 
             else:
                 # Tree models (XGBoost, Random Forest, LightGBM, etc.)
-                risk_explainer = shap.TreeExplainer(risk_model)
+                # Path-dependent raw (log-odds) output needs no background data;
+                # ranking is the same as in probability space.
+                risk_explainer = shap.TreeExplainer(
+                    risk_model, feature_perturbation="tree_path_dependent", model_output="raw"
+                )
                 print(f"SHAP: TreeExplainer initialized for {model_type}.")
                 
         except Exception as shap_e:
             print(f"SHAP Init Error ({shap_e}). Falling back to KernelExplainer (Slow).")
             if background_data is None:
-                 background_data = pd.DataFrame(0, index=np.arange(1), columns=model_features)
+                background_data = zero_background
             risk_explainer = shap.KernelExplainer(risk_model.predict_proba, background_data)
 
+        # XGBoost: an early-stopped model must stop at best_iteration (as predict_proba
+        # does); prediction and explanation both use this range.
+        if "xgboost" in model_type:
+            booster = risk_model.get_booster()
+            try:
+                iteration_range = (0, risk_model.best_iteration + 1)
+            except AttributeError:
+                iteration_range = (0, 0)  # No early stopping: use all trees
+
+        # Pick the per-request prediction path once. For binary XGBoost, inplace_predict
+        # reads the array directly instead of going through the sklearn wrapper.
+        if "xgboost" in model_type and risk_model.get_xgb_params().get("objective") == "binary:logistic":
+            _proba_fn = lambda X: booster.inplace_predict(X, iteration_range=iteration_range, predict_type="value")
+            _native_proba = True
+        elif "lightgbm" in model_type and getattr(risk_model, "objective_", None) == "binary":
+            # The LightGBM booster reads float32 arrays as-is and returns P(class 1)
+            _proba_fn = lambda X: risk_model.booster_.predict(X)
+            _native_proba = True
+        else:
+            _proba_fn = lambda X: risk_model.predict_proba(X)[:, 1]
+            _native_proba = False
+
+        # Pick the per-request SHAP path once, bypassing SHAP's Python wrapper where possible.
+        # Boosters compute TreeSHAP natively; their last output column is the bias term.
+        if "xgboost" in model_type:
+            _shap_fn = lambda X: booster.predict(
+                xgb.DMatrix(X), iteration_range=iteration_range, pred_contribs=True, validate_features=False
+            )[:, :-1]
+            print("SHAP: using native XGBoost pred_contribs.")
+        elif "lightgbm" in model_type:
+            _shap_fn = lambda X: risk_model.predict(X, pred_contrib=True)[:, :-1]
+            print("SHAP: using native LightGBM pred_contrib.")
+        elif "logistic" in model_type or "linear" in model_type:
+            # With independent features, linear SHAP is coef * (x - E[x]).
+            LINEAR_COEF = risk_model.coef_.ravel().astype(np.float32)
+            # Reuse LinearExplainer's mean: it is taken over its (sub-sampled) background.
+            if isinstance(risk_explainer, shap.LinearExplainer):
+                LINEAR_MEAN = np.asarray(risk_explainer.mean, dtype=np.float32)
+            else:
+                LINEAR_MEAN = np.asarray(background_data.mean(axis=0), dtype=np.float32)
+            _shap_fn = lambda X: LINEAR_COEF * (X - LINEAR_MEAN)
+            print("SHAP: using precomputed linear contributions.")
+        else:
+            _shap_fn = lambda X: risk_explainer(X).values
+
+        # Warm-up: pay JIT compilation and first-call setup now instead of on the first request
+        try:
+            warm = np.zeros((1, len(model_features)), dtype=np.float32)
+            _engineer_numeric(warm[0], NUMERIC_IDX, 1.0, 1.0, 0.0, 36, 10.0, 0.0,
+                              0.0, 1, 700.0, 1, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            predict_batch(warm)
+            print("Warm-up prediction done.")
+        except Exception as warm_e:
+            print(f"WARNING: Warm-up prediction failed ({warm_e}).")
+
     except Exception as e:
         print(f"CRITICAL ERROR loading model bundle: {e}")
 
@@ -154,148 +270,262 @@ FRIENDLY_NAMES = {
 }
 
 # --- Feature engineering ---
-def preprocess_user_input(raw_data, required_cols):
-
-    # Start with a 1-row dataframe of zeros, using the model's expected columns
-    input_df = pd.DataFrame(columns=required_cols)
-    input_df.loc[0] = 0
-
-    # 1) Log transforms
-    input_df['loan_amnt_log'] = np.log(float(raw_data['loan_amnt']))
-    input_df['annual_inc_log'] = np.log(float(raw_data['annual_inc']))
-    input_df['revol_bal_log'] = np.log1p(float(raw_data['revol_bal']))
-
-    # 2) Direct numeric fields
-    input_df['term_num'] = int(raw_data['term'])
-    int_rate_val = float(raw_data['int_rate'])
-    input_df['int_rate_num'] = int_rate_val
-    input_df['revol_util_num'] = float(raw_data['revol_util'])
-    input_df['emp_length_num'] = raw_data['emp_length']
-    
-    # 3) Sub-grade mapping
-    subgrade_mapping = {
-        'A1': 1, 'A2': 2, 'A3': 3, 'A4': 4, 'A5': 5,
-        'B1': 6, 'B2': 7, 'B3': 8, 'B4': 9, 'B5': 10,
-        'C1': 11, 'C2': 12, 'C3': 13, 'C4': 14, 'C5': 15,
-        'D1': 16, 'D2': 17, 'D3': 18, 'D4': 19, 'D5': 20,
-        'E1': 21, 'E2': 22, 'E3': 23, 'E4': 24, 'E5': 25,
-        'F1': 26, 'F2': 27, 'F3': 28, 'F4': 29, 'F5': 30,
-        'G1': 31, 'G2': 32, 'G3': 33, 'G4': 34, 'G5': 35
-    }
-    sub_grade_val = subgrade_mapping.get(raw_data['sub_grade'], 0)
-    input_df['sub_grade_map'] = sub_grade_val
-
-    # 4) Derived features
-    fico_range = float(raw_data['fico_range'])
-    input_df['fico_range'] = fico_range
-    
-    today = datetime.now()
-    earliest_date = datetime(raw_data['earliest_cr_line'].year, raw_data['earliest_cr_line'].month, 1) 
-    months_diff = (today.year - earliest_date.year) * 12 + (today.month - earliest_date.month)
-    input_df['earliest_cr_line_months_log'] = np.log(max(months_diff, 1))
-
-    input_df['int_rate_per_fico'] = int_rate_val / fico_range
-    total_acc = float(raw_data['total_acc'])
-    mort_acc = float(raw_data['mort_acc'])
-    input_df['mort_acc_utilization'] = mort_acc / (total_acc + 1)
-
-    # 5) Simple risk flags
-    input_df['flag_low_fico'] = 1 if fico_range < 660 else 0
-    input_df['flag_high_int_rate'] = 1 if int_rate_val > 20 else 0
-    input_df['flag_high_sub_grade'] = 1 if sub_grade_val > 25 else 0
-
-    # 6) One-hot encoding for categorical fields
-    purpose_col = f"purpose_{raw_data['purpose']}"
-    if purpose_col in input_df.columns:
-        input_df[purpose_col] = 1
-
-    app_type_col = f"application_type_{raw_data['application_type']}"
-    if app_type_col in input_df.columns:
-        input_df[app_type_col] = 1
-
-    home_val = raw_data['home_ownership']
-    if home_val in ['ANY', 'NONE']:
-        home_val = 'OTHER'
-    home_col = f"home_ownership_new_{home_val}"
-    if home_col in input_df.columns:
-        input_df[home_col] = 1
-
-    verification_status_col = f"verification_status_{raw_data['verification_status']}"
-    if verification_status_col in input_df.columns:
-        input_df[verification_status_col] = 1
-    
-    # 7) Pass-through numeric fields
-    input_df['dti'] = raw_data['dti']
-    input_df['open_acc'] = raw_data['open_acc']
-    input_df['pub_rec_clip'] = raw_data['pub_rec']
-    input_df['total_acc'] = raw_data['total_acc']
-    input_df['mort_acc'] = raw_data['mort_acc']
-    input_df['pub_rec_bankruptcies_clip'] = raw_data['pub_rec_bankruptcies']
+# Numeric model columns written by _engineer_numeric, in the order of its `idx` argument.
+NUMERIC_FEATURES = (
+    'loan_amnt_log', 'annual_inc_log', 'revol_bal_log',
+    'term_num', 'int_rate_num', 'revol_util_num', 'emp_length_num',
+    'sub_grade_map', 'fico_range', 'earliest_cr_line_months_log',
+    'int_rate_per_fico', 'mort_acc_utilization',
+    'flag_low_fico', 'flag_high_int_rate', 'flag_high_sub_grade',
+    'dti', 'open_acc', 'pub_rec_clip', 'total_acc', 'mort_acc', 'pub_rec_bankruptcies_clip',
+)
+
+@njit(cache=True)
+def _engineer_numeric(out, idx, loan_amnt, annual_inc, revol_bal, term, int_rate, revol_util,
+                      emp_length, sub_grade_val, fico_range, months_diff, total_acc, mort_acc,
+                      dti, open_acc, pub_rec, pub_rec_bankruptcies):
+    # Compiled scalar math; idx[i] is the model column of NUMERIC_FEATURES[i].
+
+    # Log transforms
+    out[idx[0]] = math.log(loan_amnt)
+    out[idx[1]] = math.log(annual_inc)
+    out[idx[2]] = math.log1p(revol_bal)
+
+    # Direct numeric fields
+    out[idx[3]] = term
+    out[idx[4]] = int_rate
+    out[idx[5]] = revol_util
+    out[idx[6]] = emp_length
+
+    # Sub-grade ordinal (looked up by the caller)
+    out[idx[7]] = sub_grade_val
+
+    # Derived features
+    out[idx[8]] = fico_range
+    out[idx[9]] = math.log(max(months_diff, 1))
+    out[idx[10]] = int_rate / fico_range
+    out[idx[11]] = mort_acc / (total_acc + 1)
+
+    # Simple risk flags
+    out[idx[12]] = 1 if fico_range < 660 else 0
+    out[idx[13]] = 1 if int_rate > 20 else 0
+    out[idx[14]] = 1 if sub_grade_val > 25 else 0
+
+    # Pass-through numeric fields
+    out[idx[15]] = dti
+    out[idx[16]] = open_acc
+    out[idx[17]] = pub_rec
+    out[idx[18]] = total_acc
+    out[idx[19]] = mort_acc
+    out[idx[20]] = pub_rec_bankruptcies
+
+# Category values the API accepts (see the README's API contract)
+KNOWN_CATEGORIES = {
+    'purpose': ('car', 'credit_card', 'debt_consolidation', 'home_improvement',
+                'major_purchase', 'medical', 'other', 'small_business'),
+    'application_type': ('Individual', 'Joint App'),
+    'verification_status': ('Not Verified', 'Source Verified', 'Verified'),
+    'home_ownership': ('MORTGAGE', 'OWN', 'RENT', 'OTHER'),
+}
 
-    return input_df
+SUBGRADE_MAPPING = {
+    'A1': 1, 'A2': 2, 'A3': 3, 'A4': 4, 'A5': 5,
+    'B1': 6, 'B2': 7, 'B3': 8, 'B4': 9, 'B5': 10,
+    'C1': 11, 'C2': 12, 'C3': 13, 'C4': 14, 'C5': 15,
+    'D1': 16, 'D2': 17, 'D3': 18, 'D4': 19, 'D5': 20,
+    'E1': 21, 'E2': 22, 'E3': 23, 'E4': 24, 'E5': 25,
+    'F1': 26, 'F2': 27, 'F3': 28, 'F4': 29, 'F5': 30,
+    'G1': 31, 'G2': 32, 'G3': 33, 'G4': 34, 'G5': 35
+}
+
+_TODAY_CACHE = [float("-inf"), (0, 0)]  # [time.monotonic() of last refresh, (year, month)]
+
+def _today_ym():
+    # Current (year, month), refreshed at most once a minute
+    now = time.monotonic()
+    if now - _TODAY_CACHE[0] > 60:
+        today = date.today()
+        _TODAY_CACHE[0] = now
+        _TODAY_CACHE[1] = (today.year, today.month)
+    return _TODAY_CACHE[1]
+
+def one_hot_index(prefix):
+    # Map raw category value -> model column, for one-hot columns named f"{prefix}{value}".
+    return {name[len(prefix):]: i for name, i in FEATURE_INDEX.items() if name.startswith(prefix)}
+
+def preprocess_user_input(application, required_cols):
+
+    # Start with a zero vector laid out in the model's expected column order
+    x = np.zeros(len(required_cols), dtype=np.float32)
+
+    # Sub-grade ordinal
+    sub_grade_val = SUBGRADE_MAPPING.get(application.sub_grade, 0)
+
+    # Credit history length in months
+    today_year, today_month = _today_ym()
+    ecl = application.earliest_cr_line
+    months_diff = (today_year - ecl.year) * 12 + (today_month - ecl.month)
+
+    # Numeric features (compiled kernel)
+    _engineer_numeric(
+        x, NUMERIC_IDX,
+        float(application.loan_amnt), float(application.annual_inc), float(application.revol_bal),
+        int(application.term), float(application.int_rate), float(application.revol_util),
+        float(application.emp_length), sub_grade_val, float(application.fico_range), months_diff,
+        float(application.total_acc), float(application.mort_acc),
+        float(application.dti), float(application.open_acc),
+        float(application.pub_rec), float(application.pub_rec_bankruptcies),
+    )
+
+    # One-hot encoding for categorical fields (only if the model has the column)
+    purpose_idx = PURPOSE_IDX.get(application.purpose)
+    if purpose_idx is not None:
+        x[purpose_idx] = 1
+
+    app_type_idx = APP_TYPE_IDX.get(application.application_type)
+    if app_type_idx is not None:
+        x[app_type_idx] = 1
+
+    home_idx = HOME_IDX.get(application.home_ownership)
+    if home_idx is not None:
+        x[home_idx] = 1
+
+    verification_status_idx = VERIF_IDX.get(application.verification_status)
+    if verification_status_idx is not None:
+        x[verification_status_idx] = 1
+    
+    # Return a single-row 2D array; column order already matches the model
+    return x.reshape(1, -1)
 
 # --- SHAP explanations ---
-def get_reasons(processed_df, prediction_cls):
-    # Return the top explanatory factors as short, user-friendly sentences.
+def get_reasons(processed_x):
+    # Return the top explanatory factors for each row as short, user-friendly sentences.
 
     # Compute SHAP values
-    shap_obj = risk_explainer(processed_df)
-    vals = shap_obj.values
+    vals = _shap_fn(processed_x)
     
-    # SHAP output shape differs by model/explainer; normalize to a 1D array.
+    # SHAP output shape differs by model/explainer; normalize to (samples, features).
     if vals.ndim == 3:
         # scikit-learn style: (samples, features, classes) -> take class 1
-        shap_values_flat = vals[0, :, 1]
-    else:
-        # tree style: (samples, features)
-        shap_values_flat = vals[0]
-
-    contributions = []
-    for col, val in zip(processed_df.columns, shap_values_flat):
-        contributions.append((col, val))
-
-    # Sort: highest positive impact first
-    # (We keep the existing behavior stable and do not change sort direction.)
-    is_rejected = (prediction_cls == 1)
-    contributions.sort(key=lambda x: x[1], reverse=True) 
-    
-    top_5 = contributions[:5]
-    reasons = []
-    
-    for feat, val in top_5:
-        friendly = FRIENDLY_NAMES.get(feat, feat)
-        reasons.append(f"{friendly} influenced this decision")
-        
-    return reasons
+        vals = vals[:, :, 1]
+
+    # Pick the top 5 per row without sorting every feature: partition, then sort
+    # just those 5 (highest positive impact first, same direction as before).
+    k = min(5, vals.shape[1])
+    top_idx = np.argpartition(vals, -k, axis=1)[:, -k:]
+    order = np.argsort(-np.take_along_axis(vals, top_idx, axis=1), axis=1)
+    top_idx = np.take_along_axis(top_idx, order, axis=1)
+
+    return REASON_TEXT[top_idx].tolist()
+
+# --- Dynamic batching ---
+# Concurrent /predict calls are coalesced so the scaler, model and explainer run
+# once per batch instead of once per row.
+MAX_BATCH = int(os.getenv("MAX_BATCH", 64))
+MAX_WAIT = float(os.getenv("MAX_WAIT_MS", 5)) / 1000
+prediction_queue = None  # asyncio.Queue of (feature row, future)
+batch_task = None
+
+# sklearn config is thread-local, so finiteness checks are switched off per call (this
+# runs in worker threads) rather than once with set_config at import time.
+@config_context(assume_finite=True)
+def predict_batch(processed_x):
+    # Score a stacked batch of feature rows; returns (probability, class, reasons) per row.
+
+    # sklearn's own NaN/inf checks are off, so check once for the whole batch whenever
+    # sklearn does the scaling or scoring. The native booster paths handle NaN/inf themselves.
+    if (risk_scaler or not _native_proba) and not np.isfinite(processed_x).all():
+        raise ValueError("Input contains NaN or infinity.")
+
+    # 1) Optional scaling (needed for many linear models)
+    if risk_scaler:
+        processed_x = risk_scaler.transform(processed_x)
+
+    # Keep the model input float32 and C-contiguous (half the bytes of float64; no
+    # conversion copies inside the boosters)
+    processed_x = np.ascontiguousarray(processed_x, dtype=np.float32)
+
+    # 2) Predict probability of class 1 (Rejected)
+    risk_probabilities = _proba_fn(processed_x)
+    if not np.isfinite(risk_probabilities).all():
+        # NaN would compare below the threshold and silently come out as "Approved"
+        raise ValueError("Model returned a non-finite probability.")
+
+    # 3) Apply the custom threshold (stored with the trained model)
+    predictions = (risk_probabilities >= custom_threshold).astype(int)
+
+    # 4) Explanations (computed on the same data given to the model)
+    reasons = get_reasons(processed_x)
+
+    # tolist() unboxes to Python floats/ints in one C call instead of per-element numpy scalars
+    return list(zip(risk_probabilities.tolist(), predictions.tolist(), reasons))
+
+async def score_rows(rows):
+    # Score rows as one batch, off the event loop so new requests keep queueing meanwhile.
+    # If the batch fails, split it in half and retry each half, so a bad row only fails
+    # itself and the good rows around it are still scored in (smaller) batches.
+    # Returns one result tuple or Exception per row.
+    try:
+        return await asyncio.to_thread(predict_batch, np.vstack(rows))
+    except Exception as e:
+        if len(rows) == 1:
+            return [e]
+    mid = len(rows) // 2
+    return await score_rows(rows[:mid]) + await score_rows(rows[mid:])
+
+async def batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        # Block for the first request, then collect more until the batch is full
+        # or MAX_WAIT has passed since the first one arrived.
+        items = [await prediction_queue.get()]
+        deadline = loop.time() + MAX_WAIT
+        while len(items) < MAX_BATCH:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(prediction_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        results = await score_rows([x for x, _ in items])
+
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+@app.on_event("startup")
+async def start_batch_worker():
+    global prediction_queue, batch_task
+    prediction_queue = asyncio.Queue()
+    batch_task = asyncio.create_task(batch_worker())
+
+@app.on_event("shutdown")
+async def stop_batch_worker():
+    if batch_task:
+        batch_task.cancel()
 
 @app.post("/predict")
 async def predict_risk(application: LoanApplication):
     if not risk_model:
         raise HTTPException(status_code=500, detail="Model not loaded. Check server logs.")
     
-    raw_data = application.model_dump()
-    
     try:
-        # 1) Feature engineering (raw API input -> model features)
-        processed_df = preprocess_user_input(raw_data, model_features)
+        # Feature engineering (raw API input -> model features)
+        processed_x = preprocess_user_input(application, model_features)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Preprocessing Error: {str(e)}")
     
     try:
-        # 2) Optional scaling (needed for many linear models)
-        if risk_scaler:
-            scaled_values = risk_scaler.transform(processed_df)
-            processed_df = pd.DataFrame(scaled_values, columns=processed_df.columns)
-        
-        # 3) Predict probability of class 1 (Rejected)
-        probs = risk_model.predict_proba(processed_df)
-        risk_probability = float(probs[0][1])
-
-        # 4) Apply the custom threshold (stored with the trained model)
-        prediction = 1 if risk_probability >= custom_threshold else 0
-
-        # 5) Explanations (computed on the same data given to the model)
-        reasons = get_reasons(processed_df, prediction)
+        # Scaling, prediction and explanations happen in the batch worker
+        future = asyncio.get_running_loop().create_future()
+        await prediction_queue.put((processed_x, future))
+        risk_probability, prediction, reasons = await future
         
         return {
             "status": "Rejected" if prediction == 1 else "Approved",
@@ -309,4 +539,12 @@ async def predict_risk(application: LoanApplication):
         raise HTTPException(status_code=500, detail=f"Prediction Error: {str(e)}")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop isn't available on Windows; fall back to the default asyncio loop there
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", 2)),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+    )
\ No newline at end of file